@@ -3,45 +3,109 @@ import json
 import fitz
 import joblib
 import re
+import string
+import numpy as np
 from tqdm import tqdm
 from collections import defaultdict
-from typing import List, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import onnxruntime as ort
+except ImportError:  # Fall back to sklearn inference
+    ort = None
+
+FEATURE_ORDER = [
+    "font_size", "is_bold", "x0", "word_count", "capital_ratio",
+    "ends_colon", "numbered", "y_distance", "is_centered",
+    "starts_capital", "all_caps", "line_length", "page_position",
+    "prev_font_size", "prev_is_bold"
+]
+
+# Common heading patterns, combined into one alternation:
+# "Chapter 1" / "Appendix A", "1.1 Introduction", ALL CAPS, Roman numerals
+_HEAD_RE = re.compile(
+    r"(?:section|chapter|appendix)\s+\w+"
+    r"|\d+(?:\.\d+)*\s+\w+"
+    r"|[A-Z][A-Z0-9\s]+$"
+    r"|[IVXLCDM]+\.?\s+\w+",
+    re.IGNORECASE
+)
+_WS_RE = re.compile(r"\s+")
+_UPPER_DEL = str.maketrans("", "", string.ascii_uppercase)
+_NUMBERED_RE = re.compile(r"^(\d+[\.\)]|[IVXLCDM]+\.?|•|\-)\s")
+
+@lru_cache(maxsize=1)
+def _load_model():
+    """Load the classifier and label encoder once per process"""
+    return joblib.load("app/model.pkl"), joblib.load("app/label_encoder.pkl")
+
+@lru_cache(maxsize=1)
+def _load_session():
+    """Load the ONNX export of the classifier if it and onnxruntime are available"""
+    if ort is None or not os.path.exists("app/model.onnx"):
+        return None
+    return ort.InferenceSession("app/model.onnx", providers=["CPUExecutionProvider"])
 
 class PDFOutlineExtractor:
     def __init__(self):
-        self.model = joblib.load("app/model.pkl")
-        self.le = joblib.load("app/label_encoder.pkl")
-        self.FEATURE_ORDER = [
-            "font_size", "is_bold", "x0", "word_count", "capital_ratio",
-            "ends_colon", "numbered", "y_distance", "is_centered",
-            "starts_capital", "all_caps", "line_length", "page_position",
-            "prev_font_size", "prev_is_bold"
-        ]
+        self.model, self.le = _load_model()
+        self.sess = _load_session()
+        self.FEATURE_ORDER = FEATURE_ORDER
         self.title_font_threshold = 0.9  # Relative to max font size
         self.min_heading_words = 2  # Minimum words to consider as heading
 
+        # A model trained on a different feature layout can't classify our rows
+        n_features = getattr(self.model, "n_features_in_", len(FEATURE_ORDER))
+        self.model_compatible = n_features == len(FEATURE_ORDER)
+        if not self.model_compatible:
+            print(f"Warning: app/model.pkl expects {n_features} features but the extractor "
+                  f"produces {len(FEATURE_ORDER)}; retrain with train_model.py. "
+                  f"Outlines will be empty until then.")
+
+    def __getstate__(self):
+        # Spawned workers reload the model through their own per-process caches
+        state = self.__dict__.copy()
+        for key in ("model", "le", "sess"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.model, self.le = _load_model()
+        self.sess = _load_session()
+
     def extract_spans(self, pdf) -> List[Dict]:
         """Extract all text spans with formatting and positional metadata"""
         spans = []
+        spans_extend = spans.extend
+        _round = round
         for page_num, page in enumerate(pdf, 1):
             page_dict = page.get_text("dict")
             page_width = page_dict.get("width", 612)  # Default US Letter width
             page_height = page_dict.get("height", 792)  # Default US Letter height
-            
-            for block in page_dict.get("blocks", []):
-                for line in block.get("lines", []):
-                    for span in line.get("spans", []):
-                        text = span.get("text", "").strip()
-                        if text:
-                            spans.append({
-                                "text": text,
-                                "font": span.get("font", "").lower(),
-                                "size": round(span["size"], 2),
-                                "bbox": [round(coord, 2) for coord in span["bbox"]],
-                                "page": page_num,
-                                "page_width": page_width,
-                                "page_height": page_height
-                            })
+
+            spans_extend([
+                {
+                    "text": text,
+                    "font": span.get("font", "").lower(),
+                    "size": _round(span["size"], 2),
+                    "bbox": span["bbox"],
+                    "page": page_num,
+                    "page_width": page_width,
+                    "page_height": page_height
+                }
+                for block in page_dict.get("blocks", ())
+                for line in block.get("lines", ())
+                for span in line.get("spans", ())
+                if (text := span.get("text", "").strip())
+            ])
         return spans
 
     def detect_title(self, spans: List[Dict]) -> str:
@@ -76,19 +140,22 @@ class PDFOutlineExtractor:
         """Check if text has characteristics of a heading"""
         if not text.strip():
             return False
-            
-        # Common heading patterns
-        patterns = [
-            r"^(section|chapter|appendix)\s+\w+",  # "Chapter 1", "Appendix A"
-            r"^\d+(\.\d+)*\s+\w+",  # "1.1 Introduction", "2.3.4 Results"
-            r"^[A-Z][A-Z0-9\s]+$",  # ALL CAPS headings
-            r"^[IVXLCDM]+\.?\s+\w+",  # Roman numerals
-        ]
-        
-        return any(re.match(p, text.strip(), re.IGNORECASE) for p in patterns)
+
+        return _HEAD_RE.match(text.strip()) is not None
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Classify a feature matrix, preferring ONNX Runtime over sklearn"""
+        # Repeated spans (e.g. running headers) share a row; classify each once
+        X, inverse = np.unique(X, axis=0, return_inverse=True)
+        if self.sess is not None:
+            preds = self.sess.run(None, {"input": X.astype(np.float32, copy=False)})[0]
+        else:
+            preds = self.model.predict(X)
+        return self.le.inverse_transform(preds)[inverse.reshape(-1)]
 
     def extract_outline(self, pdf_path: str) -> Dict:
         """Main extraction function with improved hierarchy handling"""
+        doc = None
         try:
             doc = fitz.open(pdf_path)
             spans = self.extract_spans(doc)
@@ -97,23 +164,44 @@ class PDFOutlineExtractor:
             outline = []
             current_level = 1  # Tracks current hierarchy depth
             prev_heading = None
-            
-            for i, span in enumerate(spans):
+
+            sizes = np.fromiter((s["size"] for s in spans), dtype=np.float64, count=len(spans))
+
+            # Uniform documents with no bold text have no heading tier, so the
+            # classifier is skipped. Otherwise a cheap pre-filter keeps only
+            # plausible headings: enough words, at least median font size, and
+            # bold, capitalized or heading-patterned text that isn't the title
+            cand_idx = []
+            has_tiers = len(spans) and (np.ptp(sizes) >= 1.0 or any("bold" in s["font"] for s in spans))
+            if self.model_compatible and has_tiers:
+                norm_title = normalize_text(title)
+                median_size = np.median(sizes)
+                cand_idx = [
+                    i for i, span in enumerate(spans)
+                    if span["size"] >= median_size
+                    and len(span["text"].split()) >= self.min_heading_words
+                    and ("bold" in span["font"] or span["text"][:1].isupper()
+                         or _HEAD_RE.match(span["text"]))
+                    and normalize_text(span["text"].strip()) != norm_title
+                ]
+            if not cand_idx:
+                return {
+                    "title": title,
+                    "outline": outline,
+                    "source": os.path.basename(pdf_path)
+                }
+
+            # Build features for the candidates only and predict in one call
+            X = build_feature_matrix(spans, cand_idx)
+            try:
+                labels = self.predict(X)
+            except Exception as e:
+                print(f"Classification failed for {pdf_path}: {str(e)}")
+                labels = []
+
+            for i, label in zip(cand_idx, labels):
+                span = spans[i]
                 span_text = span["text"].strip()
-                
-                # Skip if matches title or too short
-                if (normalize_text(span_text) == normalize_text(title) or 
-                    len(span_text.split()) < self.min_heading_words):
-                    continue
-                
-                # Extract features and predict
-                feats = extract_features(span, spans[i - 1] if i > 0 else None)
-                x = [[feats[k] for k in self.FEATURE_ORDER]]
-                
-                try:
-                    label = self.le.inverse_transform(self.model.predict(x))[0]
-                except:
-                    continue
 
                 if label in ("H1", "H2", "H3", "H4"):
                     level_num = int(label[1])
@@ -127,7 +215,7 @@ class PDFOutlineExtractor:
                         "level": f"H{level_num}",
                         "text": span_text,
                         "page": span["page"],
-                        "bbox": span["bbox"]
+                        "bbox": [round(c, 2) for c in span["bbox"]]
                     }
                     outline.append(heading)
                     prev_heading = {"level": level_num, "page": span["page"]}
@@ -148,76 +236,154 @@ class PDFOutlineExtractor:
                 "error": str(e)
             }
 
+        finally:
+            # Release the document and MuPDF's cached resources between PDFs
+            if doc is not None:
+                doc.close()
+                fitz.TOOLS.store_shrink(100)
+
     def process(self, input_dir="app/input", output_dir="app/output"):
         """Batch process all PDFs in directory"""
         os.makedirs(output_dir, exist_ok=True)
         stats = {"processed": 0, "errors": 0}
         
-        for filename in tqdm(os.listdir(input_dir), desc="Processing PDFs"):
-            if filename.lower().endswith(".pdf"):
-                try:
-                    result = self.extract_outline(os.path.join(input_dir, filename))
-                    out_path = os.path.join(
-                        output_dir, 
-                        filename.replace(".pdf", ".json").replace(".PDF", ".json")
-                    )
-                    with open(out_path, "w") as jf:
-                        json.dump(result, jf, indent=2)
-                    stats["processed"] += 1
-                except Exception as e:
-                    print(f"Failed to process {filename}: {str(e)}")
-                    stats["errors"] += 1
+        with os.scandir(input_dir) as it:
+            entries = [e for e in it if e.is_file() and e.name.lower().endswith(".pdf")]
+        filenames = [e.name for e in entries]
+        paths = [e.path for e in entries]
+
+        # One task per chunk, a few chunks per worker so the load stays balanced
+        workers = max(1, min(os.cpu_count() or 1, len(paths)))
+        chunksize = max(1, len(paths) // (workers * 4))
+        chunks = [
+            (filenames[i:i + chunksize], paths[i:i + chunksize])
+            for i in range(0, len(paths), chunksize)
+        ]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self,)) as pool:
+            futures = [(names, pool.submit(_extract_chunk, chunk)) for names, chunk in chunks]
+            with tqdm(total=len(paths), desc="Processing PDFs") as pbar:
+                for names, future in futures:
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        for filename in names:
+                            print(f"Failed to process {filename}: {str(e)}")
+                            stats["errors"] += 1
+                        pbar.update(len(names))
+                        continue
+
+                    for filename, result in zip(names, results):
+                        try:
+                            out_path = os.path.join(output_dir, os.path.splitext(filename)[0] + ".json")
+                            write_json(result, out_path)
+                            stats["processed"] += 1
+                        except Exception as e:
+                            print(f"Failed to process {filename}: {str(e)}")
+                            stats["errors"] += 1
+                    pbar.update(len(names))
         
         print(f"\nProcessing complete. Success: {stats['processed']}, Errors: {stats['errors']}")
 
+_worker_extractor: Optional[PDFOutlineExtractor] = None
+
+def _init_worker(extractor: PDFOutlineExtractor):
+    """Install the extractor passed from the parent process"""
+    global _worker_extractor
+    _worker_extractor = extractor
+
+def _extract_chunk(pdf_paths: List[str]) -> List[Dict]:
+    """Run extract_outline over a chunk of PDFs in a worker process"""
+    return [_worker_extractor.extract_outline(p) for p in pdf_paths]
+
+def write_json(result: Dict, out_path: str):
+    """Write result as indented JSON, using orjson when available"""
+    if orjson is not None:
+        with open(out_path, "wb") as jf:
+            jf.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    else:
+        with open(out_path, "w", encoding="utf-8") as jf:
+            json.dump(result, jf, indent=2, ensure_ascii=False)
+
 def normalize_text(text: str) -> str:
     """Normalize text for comparison"""
-    return re.sub(r"\s+", " ", text.strip().lower())
-
-def extract_features(span: Dict, prev_span: Optional[Dict] = None) -> Dict:
-    """Enhanced feature extraction with positional awareness"""
-    text = span["text"]
-    bbox = span["bbox"]
-    page_height = span.get("page_height", 792)
-    page_width = span.get("page_width", 612)
-    
-    # Calculate y-distance from previous span
-    y_distance = 0
-    if prev_span:
-        prev_bbox = prev_span["bbox"]
-        y_distance = abs(bbox[1] - prev_bbox[3])
-        
-        # Consider same line if y-difference is small
-        if abs(bbox[1] - prev_bbox[1]) < 5:
-            y_distance = 0
-    
-    # Calculate centering
-    span_center = (bbox[0] + bbox[2]) / 2
-    page_center = page_width / 2
-    is_centered = int(abs(span_center - page_center) < 0.15 * page_width)
-    
-    # Numbered heading detection
-    numbered = int(bool(re.match(r"^(\d+[\.\)]|[IVXLCDM]+\.?|•|\-)\s", text.strip())))
-    
-    features = {
-        "font_size": span["size"],
-        "is_bold": int("bold" in span.get("font", "")),
-        "x0": bbox[0],
-        "word_count": len(text.split()),
-        "capital_ratio": sum(1 for c in text if c.isupper()) / max(len(text), 1),
-        "ends_colon": int(text.strip().endswith(":")),
+    return _WS_RE.sub(" ", text.strip().lower())
+
+def _compute_geom_features(bbox_arr: np.ndarray, page_width: np.ndarray, page_height: np.ndarray):
+    """Positional features over an N x 4 bbox array"""
+    n = bbox_arr.shape[0]
+    x0 = bbox_arr[:, 0]
+    line_length = bbox_arr[:, 2] - bbox_arr[:, 0]
+    center = (bbox_arr[:, 0] + bbox_arr[:, 2]) * 0.5
+    is_centered = (np.abs(center - page_width * 0.5) < 0.15 * page_width).astype(np.int8)
+    page_position = bbox_arr[:, 1] / page_height
+
+    # Distance from previous span, zeroed when on the same line
+    y_distance = np.zeros(n, dtype=np.float32)
+    if n > 1:
+        y_distance[1:] = np.abs(bbox_arr[1:, 1] - bbox_arr[:-1, 3])
+        y_distance[1:][np.abs(np.diff(bbox_arr[:, 1])) < 5] = 0
+
+    return x0, line_length, y_distance, is_centered, page_position
+
+def build_feature_matrix(spans: List[Dict], rows: Optional[Sequence[int]] = None) -> np.ndarray:
+    """Feature extraction with positional awareness, vectorized over spans in FEATURE_ORDER.
+
+    Features are returned for the spans at `rows` (all spans by default);
+    positional and contextual features still see every span.
+    """
+    n = len(spans)
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.intp)
+    texts = [spans[i]["text"] for i in rows]
+    bbox_arr = np.asarray([s["bbox"] for s in spans], dtype=np.float32).reshape(n, 4)
+    size_arr = np.fromiter((s["size"] for s in spans), dtype=np.float32, count=n)
+    font_bold = np.fromiter(("bold" in s.get("font", "") for s in spans), dtype=np.int8, count=n)
+    page_width = np.fromiter((s.get("page_width", 612) for s in spans), dtype=np.float32, count=n)
+    page_height = np.fromiter((s.get("page_height", 792) for s in spans), dtype=np.float32, count=n)
+
+    x0, line_length, y_distance, is_centered, page_position = _compute_geom_features(
+        bbox_arr, page_width, page_height
+    )
+
+    # Contextual features: previous span's size and boldness, 0 for the first
+    prev_size = np.zeros_like(size_arr)
+    prev_size[1:] = size_arr[:-1]
+    prev_bold = np.zeros_like(font_bold)
+    prev_bold[1:] = font_bold[:-1]
+
+    # Text features
+    text_feats = np.array([
+        (
+            len(t.split()),
+            (len(t) - len(t.translate(_UPPER_DEL))) / max(len(t), 1),
+            t.strip().endswith(":"),
+            bool(_NUMBERED_RE.match(t.strip())),
+            t[:1].isupper(),
+            t.isupper(),
+        )
+        for t in texts
+    ], dtype=np.float32).reshape(len(rows), 6)
+    word_count, capital_ratio, ends_colon, numbered, starts_capital, all_caps = text_feats.T
+
+    columns = {
+        "font_size": size_arr[rows],
+        "is_bold": font_bold[rows],
+        "x0": x0[rows],
+        "word_count": word_count,
+        "capital_ratio": capital_ratio,
+        "ends_colon": ends_colon,
         "numbered": numbered,
-        "y_distance": y_distance,
-        "is_centered": is_centered,
-        "starts_capital": int(text[0].isupper()) if text else 0,
-        "all_caps": int(text.isupper()),
-        "line_length": bbox[2] - bbox[0],
-        "page_position": bbox[1] / page_height,
-        "prev_font_size": prev_span["size"] if prev_span else 0,
-        "prev_is_bold": int("bold" in prev_span.get("font", "")) if prev_span else 0
+        "y_distance": y_distance[rows],
+        "is_centered": is_centered[rows],
+        "starts_capital": starts_capital,
+        "all_caps": all_caps,
+        "line_length": line_length[rows],
+        "page_position": page_position[rows],
+        "prev_font_size": prev_size[rows],
+        "prev_is_bold": prev_bold[rows]
     }
-    
-    return features
+    return np.column_stack([columns[k] for k in FEATURE_ORDER]).astype(np.float32, copy=False)
 
 if __name__ == "__main__":
     extractor = PDFOutlineExtractor()
@@ -1,9 +1,14 @@
 import re
+import string
 from typing import Dict, Optional
 
+_WS_RE = re.compile(r"\s+")
+_UPPER_DEL = str.maketrans("", "", string.ascii_uppercase)
+_NUMBERED_RE = re.compile(r"^(\d+[\.\)]|•|\-)\s")
+
 def normalize_text(text: str) -> str:
     """Normalize text by removing extra spaces and converting to lowercase."""
-    return re.sub(r"\s+", " ", text.strip().lower())
+    return _WS_RE.sub(" ", text.strip().lower())
 
 def extract_features(span: Dict, prev_span: Optional[Dict] = None) -> Dict:
     """
@@ -40,10 +45,10 @@ def extract_features(span: Dict, prev_span: Optional[Dict] = None) -> Dict:
         "is_bold": int("bold" in span.get("font", "")),
         # Text features
         "word_count": len(text.split()),
-        "capital_ratio": sum(1 for c in text if c.isupper()) / max(len(text), 1),
+        "capital_ratio": (len(text) - len(text.translate(_UPPER_DEL))) / max(len(text), 1),
         "ends_colon": int(text.strip().endswith(":")),
-        "numbered": int(bool(re.match(r"^(\d+[\.\)]|•|\-)\s", text.strip()))),
-        "starts_capital": int(text[0].isupper()) if text else 0,
+        "numbered": int(bool(_NUMBERED_RE.match(text.strip()))),
+        "starts_capital": int(text[:1].isupper()),
         "all_caps": int(text.isupper()),
         # Positional features
         "x0": bbox[0],
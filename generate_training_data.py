@@ -1,5 +1,6 @@
 import fitz
 import os, json, re
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from app.utils import normalize_text, extract_features
@@ -7,21 +8,36 @@ from app.utils import normalize_text, extract_features
 PDF_DIR = "app/input"
 GT_DIR = "groundtruth/"
 
+# Training columns, in the order app.utils.extract_features produces them
+DTYPE = np.dtype([
+    ("font_size", "f4"), ("is_bold", "i1"), ("word_count", "i4"),
+    ("capital_ratio", "f4"), ("ends_colon", "i1"), ("numbered", "i1"),
+    ("starts_capital", "i1"), ("all_caps", "i1"), ("x0", "f4"),
+    ("y_distance", "f4"), ("is_centered", "i1"), ("line_length", "f4"),
+    ("page_position", "f4"), ("prev_font_size", "f4"), ("prev_is_bold", "i1"),
+    ("label", "U8")
+])
+FEATURE_NAMES = DTYPE.names[:-1]
+
 def extract_spans(pdf_path):
     doc = fitz.open(pdf_path)
     spans = []
+    spans_extend = spans.extend
     for page_num, page in enumerate(doc, start=1):
-        for block in page.get_text("dict")["blocks"]:
-            for line in block.get("lines", []):
-                for span in line.get("spans", []):
-                    if span["text"].strip():
-                        spans.append({
-                            "text": span["text"],
-                            "font": span.get("font", ""),
-                            "size": span["size"],
-                            "bbox": span["bbox"],
-                            "page": page_num
-                        })
+        spans_extend([
+            {
+                "text": span["text"],
+                "font": span.get("font", ""),
+                "size": span["size"],
+                "bbox": span["bbox"],
+                "page": page_num
+            }
+            for block in page.get_text("dict")["blocks"]
+            for line in block.get("lines", ())
+            for span in line.get("spans", ())
+            if span["text"].strip()
+        ])
+    doc.close()
     return spans
 
 def generator():
@@ -29,7 +45,7 @@ def generator():
     for file in tqdm(os.listdir(GT_DIR)):
         if not file.endswith(".json"):
             continue
-        base = file.replace(".json", "")
+        base = os.path.splitext(file)[0]
         json_path = os.path.join(GT_DIR, file)
         pdf_path = os.path.join(PDF_DIR, base + ".pdf")
 
@@ -50,10 +66,9 @@ def generator():
                 else gt_outline.get(norm, "None")
             )
             feat = extract_features(span, spans[i - 1] if i > 0 else None)
-            feat["label"] = label
-            rows.append(feat)
+            rows.append(tuple(feat[k] for k in FEATURE_NAMES) + (label,))
 
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame.from_records(np.array(rows, dtype=DTYPE))
     df.to_csv("training_data.csv", index=False)
     print("training_data.csv generated!")
 